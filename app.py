@@ -1,68 +1,170 @@
 import streamlit as st
 import os
-import yt_dlp
 import logging
 import sys
 from datetime import datetime
 #from moviepy.editor import VideoFileClip
 import subprocess
 import tempfile
+import re
+import time
+import queue
+import concurrent.futures
+import workers
+from prefetch import MetadataPrefetcher
+from quality_selector import estimate_filesize
 
 # Load custom CSS
 def load_css():
     with open('style.css') as f:
         st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
 
-# Configure page
-st.set_page_config(
-    page_title="Asset Hole YouTube Downloader",
-    page_icon="🎥",
-    layout="wide"
-)
-
-# Load CSS
-load_css()
-
-# Configure logging
-log_filename = f"youtube_downloader_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+def setup():
+    """
+    Page, logging and filesystem setup for the Streamlit run
+
+    Kept out of the module top level: worker processes are spawned with this
+    script as their main module and re-import it as __mp_main__, where none of
+    this should happen.
+    """
+    # Configure page
+    st.set_page_config(
+        page_title="Asset Hole YouTube Downloader",
+        page_icon="🎥",
+        layout="wide"
+    )
+
+    # Load CSS
+    load_css()
+
+    # Configure logging
+    log_filename = f"youtube_downloader_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_filename),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+    # Create downloads directory at startup
+    if not os.path.exists("downloads"):
+        os.makedirs("downloads")
+
 logger = logging.getLogger(__name__)
 
-def download_video(url, output_path, format='mp4', quality='normal'):
+# Common options for both info extraction and download
+COMMON_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,
+    # Add these options to help bypass restrictions
+    'nocheckcertificate': True,
+    'geo_bypass': True,
+    'format': 'best',
+    # Add custom headers
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+}
+
+def is_valid_youtube_url(url):
+    """Validate YouTube URL format"""
+    youtube_regex = r'^(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+$'
+    return bool(re.match(youtube_regex, url))
+
+def submit_extraction(url):
+    """Start extracting video information and resolving formats in a worker process"""
+    return workers.submit(workers.extract_info_job, url, COMMON_OPTS)
+
+def fetch_video_info(url):
+    """Extract video information without downloading, reusing a prefetch of the same URL"""
+    prefetcher = get_prefetcher()
+    # Hold an interest while waiting, so another session moving on can't cancel the extraction
+    future = prefetcher.subscribe(url)
+    try:
+        return future.result()
+    finally:
+        prefetcher.unsubscribe(url)
+
+def run_download(info, ydl_opts, media_format=None, deadline=None):
+    """Download in a worker process, showing the progress it reports back"""
+    manager = workers.get_manager()
+    progress_queue = manager.Queue()
+    cancel_event = manager.Event()
+    future = workers.submit_download(workers.download_job, info, ydl_opts, progress_queue, media_format, deadline, cancel_event)
+    try:
+        progress_bar = st.progress(0.0)
+        while True:
+            done = future.done()
+            try:
+                while True:
+                    progress = progress_queue.get_nowait()
+                    if progress['total']:
+                        progress_bar.progress(min(progress['downloaded'] / progress['total'], 1.0))
+            except queue.Empty:
+                pass
+            if done:
+                break
+            time.sleep(0.2)
+    finally:
+        if not future.done():
+            # The session reran or stopped: stop the job, and let it finish before the caller removes its files
+            cancel_event.set()
+            if not future.cancel():
+                concurrent.futures.wait([future])
+    return future.result()
+
+@st.cache_resource
+def get_prefetcher():
+    """Prefetcher shared by all sessions, so the same video is only extracted once"""
+    return MetadataPrefetcher(submit_extraction)
+
+def summarize_formats(info):
+    """One row per video resolution/container with its estimated size"""
+    duration = info.get('duration') or 0
+    rows = {}
+    for fmt in info.get('formats') or []:
+        height = fmt.get('height')
+        if not height or fmt.get('vcodec') == 'none':
+            continue
+        size = estimate_filesize(fmt, duration)
+        key = (height, fmt.get('ext'))
+        if size and (key not in rows or size > rows[key]):
+            rows[key] = size
+    return [
+        {'Resolution': f"{height}p", 'Format': ext, 'Estimated size': f"{size / (1024*1024):.1f} MB"}
+        for (height, ext), size in sorted(rows.items(), reverse=True)
+    ]
+
+@st.fragment(run_every=0.5)
+def wait_for_prefetch(future):
+    """Placeholder that polls the prefetch without blocking the script, then reruns the app"""
+    if future.done():
+        st.rerun()
+    st.caption("⏳ Fetching video details...")
+
+def show_video_details(info):
+    st.info(f"Title: {info.get('title', 'video')}")
+    st.info(f"Length: {info.get('duration', 0)} seconds")
+    rows = summarize_formats(info)
+    if rows:
+        st.table(rows)
+
+def download_video(url, output_path, format='mp4', quality='normal', info=None, deadline=None):
     # Create a temporary directory
     temp_dir = tempfile.mkdtemp()
     try:
         logger.info(f"Starting download process for URL: {url} in format: {format} with quality: {quality}")
         
-        # Common options for both info extraction and download
-        common_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-            # Add these options to help bypass restrictions
-            'nocheckcertificate': True,
-            'geo_bypass': True,
-            'format': 'best',
-            # Add custom headers
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-        }
-        
         # Quality settings
         if format == 'mp4':
             if quality == 'high':
                 format_string = 'bestvideo[ext=mp4][height>=1080]+bestaudio[ext=m4a]/best[ext=mp4]/best'
             elif quality == 'medium':
                 format_string = 'bestvideo[ext=mp4][height>=720][height<1080]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-            else:  # normal
+            else:  # normal, or the fallback for auto
                 format_string = 'best[ext=mp4]'
         else:  # mp3
             format_string = 'bestaudio/best'
@@ -70,13 +172,13 @@ def download_video(url, output_path, format='mp4', quality='normal'):
         # Update ydl_opts based on format and quality
         if format == 'mp4':
             ydl_opts = {
-                **common_opts,
+                **COMMON_OPTS,
                 'format': format_string,
                 'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
             }
         else:  # mp3
             ydl_opts = {
-                **common_opts,
+                **COMMON_OPTS,
                 'format': format_string,
                 'postprocessors': [{
                     'key': 'FFmpegExtractAudio',
@@ -86,39 +188,39 @@ def download_video(url, output_path, format='mp4', quality='normal'):
                 'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
             }
 
-        # First, get video information
-        with yt_dlp.YoutubeDL(common_opts) as ydl:
+        # First, get video information unless it was already prefetched
+        if info is None:
             try:
                 logger.debug("Fetching video information")
-                info = ydl.extract_info(url, download=False)
-                title = info.get('title', 'video')
-                duration = info.get('duration', 0)
-                
-                logger.info(f"Video details - Title: {title}, Duration: {duration} seconds")
-                st.info(f"Title: {title}")
-                st.info(f"Length: {duration} seconds")
-                
+                info = fetch_video_info(url)
+                st.info(f"Title: {info.get('title', 'video')}")
+                st.info(f"Length: {info.get('duration', 0)} seconds")
             except Exception as e:
                 logger.error(f"Error fetching video info: {str(e)}", exc_info=True)
                 st.error(f"Error fetching video info: {str(e)}")
                 return None, None, None
+        title = info.get('title', 'video')
+        duration = info.get('duration', 0)
+        logger.info(f"Video details - Title: {title}, Duration: {duration} seconds")
 
-        # Download the video/audio
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                ydl.download([url])
-                downloaded_files = os.listdir(temp_dir)
-                if downloaded_files:
-                    file_path = os.path.join(temp_dir, downloaded_files[0])
-                    # Read the file content before returning
-                    with open(file_path, 'rb') as f:
-                        file_content = f.read()
-                    return file_content, title, downloaded_files[0]
-                return None, None, None
-            except Exception as e:
-                logger.error(f"Error during download: {str(e)}", exc_info=True)
-                st.error(f"Error during download: {str(e)}")
-                return None, None, None
+        # Download the video/audio from the extracted info instead of extracting the URL again
+        try:
+            if quality == 'auto':
+                # Picks the best format expected to finish by the deadline
+                file_path = run_download(info, ydl_opts, format, deadline)
+            else:
+                file_path = run_download(info, ydl_opts)
+            # Use the file yt-dlp reports as final; the temp dir may also hold leftover streams
+            if file_path and os.path.exists(file_path):
+                # Read the file content before returning
+                with open(file_path, 'rb') as f:
+                    file_content = f.read()
+                return file_content, title, os.path.basename(file_path)
+            return None, None, None
+        except Exception as e:
+            logger.error(f"Error during download: {str(e)}", exc_info=True)
+            st.error(f"Error during download: {str(e)}")
+            return None, None, None
     finally:
         # Clean up the temporary directory
         try:
@@ -155,19 +257,56 @@ def main():
         format_option = st.radio("📦 Select Format:", ('MP4', 'MP3'))
     
     with col3:
-        quality_option = st.radio("🎯 Quality:", ('Normal', 'Medium', 'High'))
+        quality_option = st.radio("🎯 Quality:", ('Normal', 'Medium', 'High', 'Auto'))
+        time_budget = None
+        if quality_option == 'Auto':
+            time_budget = st.number_input("⏱️ Deliver within (seconds):", min_value=10, value=120, step=10)
     
     # Download section
     st.markdown('<div class="download-section">', unsafe_allow_html=True)
-    if st.button("⬇️ Download"):
+    details = st.container()
+    download_clicked = st.button("⬇️ Download")
+
+    # Start extracting as soon as a URL is entered. Sessions share prefetches, so this one only
+    # subscribes to its current URL and gives up its interest when the URL is replaced
+    prefetcher = get_prefetcher()
+    prefetch_url = url if url and is_valid_youtube_url(url) else None
+    previous_url = st.session_state.get('prefetch_url')
+    if previous_url != prefetch_url:
+        if previous_url:
+            prefetcher.unsubscribe(previous_url)
+        st.session_state['prefetch_url'] = prefetch_url
+        if prefetch_url:
+            prefetcher.subscribe(prefetch_url)
+    info = None
+    if prefetch_url:
+        future = prefetcher.prefetch(prefetch_url)
+        with details:
+            if not future.done():
+                # Don't block this run, so a new URL cancels the prefetch right away. A download
+                # waits for the prefetch itself, and a rerun from the poller would wipe its result
+                if not download_clicked:
+                    wait_for_prefetch(future)
+            elif future.exception():
+                logger.error(f"Error prefetching video info: {str(future.exception())}")
+                st.error(f"Error fetching video info: {str(future.exception())}")
+            else:
+                info = future.result()
+                show_video_details(info)
+
+    if download_clicked:
         if url:
             logger.info(f"Download requested for URL: {url} in format: {format_option} with quality: {quality_option}")
+            # The budget runs from the click, so waiting for a worker or for the video info counts too
+            deadline = time.time() + time_budget if time_budget else None
             with st.spinner("Processing..."):
                 file_content, title, filename = download_video(
                     url, 
                     None, 
                     format_option.lower(), 
-                    quality_option.lower()
+                    quality_option.lower(),
+                    info=info,
+                    deadline=deadline
                 )
                 
                 if file_content and title and filename:
@@ -204,9 +343,6 @@ def main():
         - Checking if the video is publicly available
     """)
 
-# Create downloads directory at startup
-if not os.path.exists("downloads"):
-    os.makedirs("downloads")
-
 if __name__ == "__main__":
+    setup()
     main() 
\ No newline at end of file
@@ -0,0 +1,141 @@
+import os
+import time
+import logging
+import threading
+
+import yt_dlp
+from yt_dlp.cookies import YoutubeDLCookieJar
+
+logger = logging.getLogger(__name__)
+
+# Cookie file shipped with the repo; can be overridden per deployment
+DEFAULT_COOKIE_FILE = os.getenv(
+    'YOUTUBE_COOKIES_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'youtube-cookies.txt')
+)
+
+# A logged-in export has LOGIN_INFO plus one of the SAPISID cookies; YouTube clears
+# LOGIN_INFO when it rotates the session (same check as yt-dlp's _has_auth_cookies)
+LOGIN_COOKIE = 'LOGIN_INFO'
+SAPISID_COOKIES = ('SAPISID', '__Secure-1PAPISID', '__Secure-3PAPISID')
+# Errors that mean YouTube refused the login, as opposed to e.g. an age gate
+AUTH_ERROR_MARKERS = ('not a bot', 'Login details are needed', 'only available for registered users')
+
+class CookieSet:
+    """Cookies parsed from a single Netscape cookie file, shared by every caller in the process"""
+
+    def __init__(self, path):
+        self.path = path
+        self.jar = None
+        self.mtime = None
+        self.has_login = False
+        self.rejected = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the parsed cookie jar, re-reading the file only when it changed on disk"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+        with self._lock:
+            if self.jar is None or mtime != self.mtime:
+                try:
+                    jar = YoutubeDLCookieJar(self.path)
+                    jar.load(ignore_discard=True, ignore_expires=True)
+                except Exception as e:
+                    logger.error(f"Error loading cookies from {self.path}: {str(e)}")
+                    return self.jar
+                self.jar = jar
+                self.mtime = mtime
+                self.has_login = self._has_auth_cookies(jar)
+                # A freshly exported file gets another chance
+                self.rejected = False
+                logger.info(f"Loaded {len(jar)} cookies from {self.path}"
+                            f"{' (logged in)' if self.has_login else ''}")
+            return self.jar
+
+    @staticmethod
+    def _has_auth_cookies(jar):
+        now = time.time()
+        names = {cookie.name for cookie in jar
+                 if cookie.domain.endswith('youtube.com') and not cookie.is_expired(now)}
+        return LOGIN_COOKIE in names and any(name in names for name in SAPISID_COOKIES)
+
+    def invalidate(self):
+        """Mark this logged-in cookie set as rejected by YouTube until the file changes"""
+        if not self.has_login:
+            # Anonymous cookies (consent, preferences) are not what YouTube refused
+            return
+        logger.warning(f"Cookies from {self.path} marked invalid")
+        self.rejected = True
+
+    def is_valid(self):
+        """
+        True if the set is loaded and still usable
+
+        A logged-in set must not be rejected and must still hold its auth cookies,
+        which catches both expiry and rotation (the jar is shared, so cookies YouTube
+        clears on a response are gone here too). An anonymous set only needs some
+        unexpired cookie.
+        """
+        jar = self.load()
+        if jar is None or self.rejected:
+            return False
+        if self.has_login:
+            return self._has_auth_cookies(jar)
+        now = time.time()
+        return any(not cookie.is_expired(now) for cookie in jar)
+
+
+_cookie_sets = {}
+_registry_lock = threading.Lock()
+
+def get_cookie_set(path=None):
+    """Get the process-wide CookieSet for a cookie file"""
+    path = os.path.abspath(path or DEFAULT_COOKIE_FILE)
+    with _registry_lock:
+        if path not in _cookie_sets:
+            _cookie_sets[path] = CookieSet(path)
+        return _cookie_sets[path]
+
+def apply_cookies(ydl, path=None):
+    """
+    Attach the shared cookie jar to a YoutubeDL instance
+
+    The request handlers capture the jar when they are built, so this must run
+    before the instance makes any request; use create_ydl unless that is certain.
+
+    Returns:
+        bool: True if valid cookies were attached
+    """
+    cookie_set = get_cookie_set(path)
+    if not cookie_set.is_valid():
+        return False
+    # YoutubeDL.cookiejar is a cached property; assigning it skips yt-dlp's own file/browser loading
+    ydl.cookiejar = cookie_set.jar
+    if '_request_director' in ydl.__dict__:
+        # Handlers built earlier still hold the old jar
+        ydl._request_director.close()
+        del ydl._request_director
+    return True
+
+def create_ydl(ydl_opts, path=None):
+    """Create a YoutubeDL that sends the shared cookies on every request"""
+    # The verbose header builds the request handlers, so hold it back until the jar is in place
+    ydl = yt_dlp.YoutubeDL(ydl_opts, auto_init='no_verbose_header')
+    apply_cookies(ydl, path)
+    if ydl.params.get('verbose'):
+        ydl.print_debug_header()
+    return ydl
+
+def is_auth_error(error):
+    """Check whether a yt-dlp error means YouTube refused the login (bot check or login required)"""
+    message = str(error)
+    return any(marker in message for marker in AUTH_ERROR_MARKERS)
+
+def check_auth_error(error, path=None):
+    """Invalidate the cookie set if `error` says YouTube refused its cookies"""
+    if is_auth_error(error):
+        get_cookie_set(path).invalidate()
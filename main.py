@@ -7,8 +7,13 @@ import logging
 from datetime import datetime
 import tempfile
 import re
-import yt_dlp
+import time
+import gzip
+import hashlib
+import threading
 import functions_framework
+from cookie_provider import create_ydl, check_auth_error
+from quality_selector import ThroughputMeter, ThroughputTracker, download_within_budget
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,13 +30,39 @@ else:
     storage_client = storage.Client()
 BUCKET_NAME = "nd-pi-ec02a.appspot.com"
 
+# Metadata fields callers can ask for, and what they get when they don't ask
+INFO_FIELDS = ('id', 'title', 'duration', 'uploader', 'channel', 'view_count',
+               'upload_date', 'thumbnail', 'formats')
+DEFAULT_INFO_FIELDS = ('title', 'duration')
+FORMAT_FIELDS = ('format_id', 'ext', 'width', 'height', 'fps', 'vcodec', 'acodec',
+                 'tbr', 'filesize', 'filesize_approx')
+
+# Metadata is cached per warm instance; YouTube format URLs expire after a few hours
+INFO_CACHE_TTL = 3600
+INFO_CACHE_SIZE = 128
+COMPRESS_MIN_SIZE = 1024
+# Rough rate of the upload to Cloud Storage, reserved out of a download's time budget
+UPLOAD_THROUGHPUT = float(os.getenv('UPLOAD_THROUGHPUT_BPS', 20 * 1024 * 1024))
+_info_cache = {}
+_info_cache_lock = threading.Lock()
+
 def is_valid_youtube_url(url: str) -> bool:
     """Validate YouTube URL format"""
     youtube_regex = r'^(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+$'
     return bool(re.match(youtube_regex, url))
 
 def get_video_info(url: str) -> dict:
-    """Get video info without downloading"""
+    """Get video info without downloading, cached per URL"""
+    entry = _get_cache_entry(url)
+    return entry['info'] if entry else None
+
+def _get_cache_entry(url: str) -> dict:
+    """Return the cache entry for a URL, extracting the metadata if it is missing or stale"""
+    with _info_cache_lock:
+        entry = _info_cache.get(url)
+    if entry and time.time() - entry['fetched_at'] < INFO_CACHE_TTL:
+        return entry
+
     try:
         ydl_opts = {
             'quiet': True,
@@ -41,19 +72,78 @@ def get_video_info(url: str) -> dict:
             'geo_bypass': True
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with create_ydl(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=False)
-            return {
-                'title': info.get('title', 'video'),
-                'duration': info.get('duration', 0),
-                'formats': info.get('formats', [])
-            }
     except Exception as e:
         logger.error(f"Error getting video info: {str(e)}")
+        check_auth_error(e)
         return None
 
-def download_video(url: str, output_path: str) -> bool:
-    """Download the video to the specified output path"""
+    # Keep only the fields we serve; the raw info dict is far larger
+    slim_info = {field: info.get(field) for field in INFO_FIELDS if field != 'formats'}
+    slim_info['title'] = info.get('title', 'video')
+    slim_info['duration'] = info.get('duration', 0)
+    slim_info['formats'] = [
+        {key: fmt[key] for key in FORMAT_FIELDS if fmt.get(key) is not None}
+        for fmt in info.get('formats', [])
+    ]
+
+    entry = {'fetched_at': time.time(), 'info': slim_info, 'payloads': {}}
+    with _info_cache_lock:
+        if url not in _info_cache and len(_info_cache) >= INFO_CACHE_SIZE:
+            oldest = min(_info_cache, key=lambda u: _info_cache[u]['fetched_at'])
+            del _info_cache[oldest]
+        _info_cache[url] = entry
+    return entry
+
+def parse_fields(fields) -> tuple:
+    """Turn a comma separated string or list of field names into a validated tuple"""
+    if not fields:
+        return DEFAULT_INFO_FIELDS
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+        raise ValueError("fields must be a comma separated string or a list of field names")
+    fields = tuple(field.strip() for field in fields if field.strip())
+    unknown = [field for field in fields if field not in INFO_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def project_info(info: dict, fields: tuple) -> dict:
+    """Select the requested fields from the video info"""
+    return {field: info.get(field) for field in fields}
+
+def _get_payload(entry: dict, fields: tuple) -> dict:
+    """Serialize a projection once and reuse it, along with its ETag and gzip body"""
+    with _info_cache_lock:
+        payload = entry['payloads'].get(fields)
+    if not payload:
+        body = json.dumps(project_info(entry['info'], fields), separators=(',', ':')).encode('utf-8')
+        payload = {'body': body, 'etag': hashlib.sha1(body).hexdigest(), 'gzip': None}
+        with _info_cache_lock:
+            payload = entry['payloads'].setdefault(fields, payload)
+    return payload
+
+def _get_gzip_body(payload: dict) -> bytes:
+    """Compress a payload body once and reuse it"""
+    with _info_cache_lock:
+        compressed = payload['gzip']
+    if compressed is None:
+        compressed = gzip.compress(payload['body'])
+        with _info_cache_lock:
+            if payload['gzip'] is None:
+                payload['gzip'] = compressed
+            compressed = payload['gzip']
+    return compressed
+
+def download_video(url: str, output_path: str, deadline: float = None) -> bool:
+    """
+    Download the video to the specified output path
+
+    With a `deadline` (a time.time() timestamp), the best quality expected to be downloaded
+    and uploaded by then is picked from measured throughput instead of the fixed format.
+    """
     try:
         ydl_opts = {
             'outtmpl': output_path,
@@ -69,21 +159,28 @@ def download_video(url: str, output_path: str) -> bool:
             'max_filesize': 2000000000  # Limit to ~2GB for cloud function
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Starting download to: {output_path}")
-            ydl.download([url])
-            
-            # Verify file exists and has size
-            if os.path.exists(output_path):
-                size = os.path.getsize(output_path)
-                logger.info(f"Download complete. File size: {size / (1024*1024):.2f} MB")
-                return size > 0
-            
-            logger.error("File does not exist after download")
-            return False
+        logger.info(f"Starting download to: {output_path}")
+        if deadline:
+            download_within_budget(url, ydl_opts, 'mp4', deadline, handoff_throughput=UPLOAD_THROUGHPUT)
+        else:
+            meter = ThroughputMeter()
+            with create_ydl(ydl_opts) as ydl:
+                ydl.add_progress_hook(meter)
+                ydl.download([url])
+            ThroughputTracker().record(meter.downloaded_bytes, meter.elapsed)
+
+        # Verify file exists and has size
+        if os.path.exists(output_path):
+            size = os.path.getsize(output_path)
+            logger.info(f"Download complete. File size: {size / (1024*1024):.2f} MB")
+            return size > 0
+        
+        logger.error("File does not exist after download")
+        return False
             
     except Exception as e:
         logger.error(f"Error downloading video: {str(e)}")
+        check_auth_error(e)
         return False
 
 @functions_framework.http
@@ -110,6 +207,17 @@ def download_youtube(request: Request):
         if not is_valid_youtube_url(video_url):
             return (jsonify({'error': 'Invalid YouTube URL'}), 400, headers)
 
+        try:
+            fields = parse_fields(request_json.get('fields'))
+        except ValueError as e:
+            return (jsonify({'error': str(e)}), 400, headers)
+
+        time_budget = request_json.get('time_budget')
+        if time_budget is not None and (isinstance(time_budget, bool) or not isinstance(time_budget, (int, float)) or time_budget <= 0):
+            return (jsonify({'error': 'time_budget must be a positive number of seconds'}), 400, headers)
+        # The budget covers the whole request, including the metadata lookup below
+        deadline = time.time() + time_budget if time_budget else None
+
         logger.info(f"Processing request for URL: {video_url}")
 
         # Get video info
@@ -128,7 +236,7 @@ def download_youtube(request: Request):
             
             try:
                 logger.info("Downloading video...")
-                success = download_video(video_url, temp_file_path)
+                success = download_video(video_url, temp_file_path, deadline)
                 
                 if not success:
                     return (jsonify({'error': 'Could not download video'}), 500, headers)
@@ -158,7 +266,7 @@ def download_youtube(request: Request):
                     'title': info['title'],
                     'filename': filename,
                     'download_url': blob.public_url,
-                    'video_info': info,
+                    'video_info': project_info(info, fields),
                     'file_size_mb': file_size / (1024*1024)
                 }), 200, headers)
 
@@ -166,6 +274,62 @@ def download_youtube(request: Request):
                 logger.error(f"Processing error: {str(e)}")
                 return (jsonify({'error': str(e)}), 500, headers)
 
+    except Exception as e:
+        logger.error(f"Function error: {str(e)}")
+        return (jsonify({'error': str(e)}), 500, headers)
+
+@functions_framework.http
+def get_youtube_info(request: Request):
+    """HTTP Cloud Function that returns video metadata without downloading anything"""
+    headers = {'Access-Control-Allow-Origin': '*'}
+
+    if request.method == 'OPTIONS':
+        headers.update({
+            'Access-Control-Allow-Methods': 'GET, POST',
+            'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
+            'Access-Control-Max-Age': '3600'
+        })
+        return ('', 204, headers)
+
+    try:
+        request_json = request.get_json(silent=True) or {}
+        video_url = request_json.get('url') or request.args.get('url')
+        if not video_url:
+            return (jsonify({'error': 'No URL provided'}), 400, headers)
+
+        if not is_valid_youtube_url(video_url):
+            return (jsonify({'error': 'Invalid YouTube URL'}), 400, headers)
+
+        try:
+            fields = parse_fields(request_json.get('fields') or request.args.get('fields'))
+        except ValueError as e:
+            return (jsonify({'error': str(e)}), 400, headers)
+
+        entry = _get_cache_entry(video_url)
+        if not entry:
+            return (jsonify({'error': 'Could not get video info'}), 500, headers)
+
+        payload = _get_payload(entry, fields)
+        body = payload['body']
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '') and len(body) >= COMPRESS_MIN_SIZE
+        # The gzip body is a different representation, so it must not share the identity body's strong ETag
+        etag = f"{payload['etag']}-gzip" if use_gzip else payload['etag']
+        headers.update({
+            'ETag': f'"{etag}"',
+            # Clients may only reuse it for as long as our cached copy stays fresh
+            'Cache-Control': f'public, max-age={max(int(INFO_CACHE_TTL - (time.time() - entry["fetched_at"])), 0)}',
+            'Vary': 'Accept-Encoding'
+        })
+        if request.if_none_match.contains(etag):
+            return ('', 304, headers)
+
+        if use_gzip:
+            body = _get_gzip_body(payload)
+            headers['Content-Encoding'] = 'gzip'
+
+        headers['Content-Type'] = 'application/json'
+        return (body, 200, headers)
+
     except Exception as e:
         logger.error(f"Function error: {str(e)}")
         return (jsonify({'error': str(e)}), 500, headers)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class MetadataPrefetcher:
+    """
+    Start video info extraction in the background ahead of the download
+
+    `submit` takes a URL and returns a Future for its extraction, e.g. a job in
+    the worker pool. Requests are deduplicated by URL, so several reruns or
+    sessions asking for the same video share one extraction. Finished results
+    are kept for `ttl` seconds, since the format URLs YouTube hands out expire
+    after a few hours. Failed extractions are kept for `retry_after` seconds so
+    a broken URL is not extracted again on every rerun.
+    """
+
+    def __init__(self, submit, ttl=1800, retry_after=60, max_entries=64):
+        self.submit = submit
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.max_entries = max_entries
+        self._futures = {}
+        self._subscribers = {}
+        self._finished = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, url):
+        """Start extracting `url` in the background, or return the extraction already under way"""
+        with self._lock:
+            return self._prefetch(url)
+
+    def subscribe(self, url):
+        """Like prefetch, but registers interest so the extraction is only cancelled once nobody wants it"""
+        with self._lock:
+            self._subscribers[url] = self._subscribers.get(url, 0) + 1
+            return self._prefetch(url)
+
+    def unsubscribe(self, url):
+        """
+        Drop interest in `url`; with no subscribers left, cancel its prefetch
+
+        Jobs still queued in the pool are dropped. Extraction that has already
+        started cannot be interrupted; it is left to finish so its result can
+        still be reused. A failed extraction is forgotten, so the URL is retried
+        the next time it is entered.
+        """
+        with self._lock:
+            count = self._subscribers.get(url, 0) - 1
+            if count > 0:
+                self._subscribers[url] = count
+                return
+            self._subscribers.pop(url, None)
+            entry = self._futures.get(url)
+            if not entry:
+                return
+            future = entry[1]
+            if future.cancel():
+                logger.debug(f"Cancelled prefetch for URL: {url}")
+                self._drop(url)
+            elif future.done() and future.exception():
+                self._drop(url)
+
+    def _prefetch(self, url):
+        self._evict()
+        entry = self._futures.get(url)
+        if entry:
+            return entry[1]
+        logger.debug(f"Prefetching video information for URL: {url}")
+        future = self.submit(url)
+        self._futures[url] = (time.monotonic(), future)
+        future.add_done_callback(lambda f: self._finished.__setitem__(f, time.monotonic()))
+        return future
+
+    def _evict(self):
+        now = time.monotonic()
+        for url, (started, future) in list(self._futures.items()):
+            if not future.done():
+                continue
+            if future.cancelled():
+                expired = True
+            elif future.exception():
+                # Back off from when the failure happened, not from when the extraction started
+                expired = now - self._finished.get(future, now) > self.retry_after
+            else:
+                expired = now - started > self.ttl
+            if expired:
+                self._drop(url)
+        while len(self._futures) > self.max_entries:
+            oldest = min(self._futures, key=lambda u: self._futures[u][0])
+            self._futures[oldest][1].cancel()
+            self._drop(oldest)
+            self._subscribers.pop(oldest, None)
+
+    def _drop(self, url):
+        _, future = self._futures.pop(url)
+        self._finished.pop(future, None)
@@ -0,0 +1,274 @@
+import os
+import glob
+import json
+import time
+import logging
+import tempfile
+import threading
+import statistics
+
+from cookie_provider import create_ydl
+
+logger = logging.getLogger(__name__)
+
+# Recent throughput samples are kept on disk so CLI runs and worker processes share them
+THROUGHPUT_FILE = os.getenv('THROUGHPUT_FILE', os.path.join(tempfile.gettempdir(), 'asset-hole-throughput.json'))
+MAX_SAMPLES = 10
+# Assumed when nothing has been measured yet for a link
+DEFAULT_THROUGHPUT = float(os.getenv('DEFAULT_THROUGHPUT_BPS', 1024 * 1024))
+# Plan against slightly less than the measured rate
+SAFETY_FACTOR = 0.8
+# Give a download this long to reach its speed before judging it
+GRACE_PERIOD = 5
+# Samples from tiny transfers say more about latency than bandwidth
+MIN_SAMPLE_BYTES = 512 * 1024
+# Rough FFmpeg rate for merging streams or extracting audio, in bytes per second
+POSTPROCESS_THROUGHPUT = 50 * 1024 * 1024
+
+class DeadlineExceeded(Exception):
+    """Raised from a progress hook when a download can no longer finish in time"""
+
+
+class ThroughputTracker:
+    """Recent download throughput per link (e.g. 'direct' or 'proxy'), in bytes per second"""
+
+    def __init__(self, link='direct', path=THROUGHPUT_FILE):
+        self.link = link
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def record(self, nbytes, seconds):
+        """Add a sample from a finished or aborted download"""
+        if seconds <= 0 or nbytes < MIN_SAMPLE_BYTES:
+            return
+        samples = self._load()
+        link_samples = samples.get(self.link, [])
+        link_samples.append(nbytes / seconds)
+        samples[self.link] = link_samples[-MAX_SAMPLES:]
+        try:
+            # Write then rename, so concurrent readers never see a partial file
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(samples, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save throughput samples: {str(e)}")
+
+    def estimate(self):
+        """Conservative throughput estimate, or DEFAULT_THROUGHPUT without samples"""
+        link_samples = self._load().get(self.link)
+        if not link_samples:
+            return DEFAULT_THROUGHPUT
+        return statistics.median(link_samples) * SAFETY_FACTOR
+
+
+class ThroughputMeter:
+    """Progress hook measuring the bytes and time spent by one download attempt"""
+
+    def __init__(self):
+        self.files = {}
+
+    def __call__(self, d):
+        if d.get('status') in ('downloading', 'finished') and d.get('elapsed'):
+            self.files[d.get('filename')] = (d.get('downloaded_bytes') or d.get('total_bytes') or 0, d['elapsed'])
+
+    @property
+    def downloaded_bytes(self):
+        return sum(nbytes for nbytes, _ in self.files.values())
+
+    @property
+    def elapsed(self):
+        return sum(elapsed for _, elapsed in self.files.values())
+
+    @property
+    def throughput(self):
+        return self.downloaded_bytes / self.elapsed if self.elapsed else None
+
+
+class DeadlineGuard:
+    """
+    Progress hook that aborts a download whose projected finish is past the deadline
+
+    `deadline` is a time.time() timestamp. The projection covers the whole candidate: what is left of its estimated size
+    across all of its streams, as counted by `meter`, plus its post-processing time.
+    `meter` must run before the guard in the progress hooks.
+    """
+
+    def __init__(self, deadline, candidate, meter):
+        self.deadline = deadline
+        self.candidate = candidate
+        self.meter = meter
+        self.started = time.monotonic()
+        self.tripped = False
+
+    def __call__(self, d):
+        if d.get('status') != 'downloading':
+            return
+        speed = d.get('speed')
+        if time.monotonic() - self.started < GRACE_PERIOD or not speed:
+            return
+        # The estimate can be low, so never assume less than what the current file still needs
+        total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+        remaining_bytes = max(self.candidate['size'] - self.meter.downloaded_bytes,
+                              total - (d.get('downloaded_bytes') or 0), 0)
+        finish = time.time() + remaining_bytes / speed + self.candidate['postprocess']
+        if finish > self.deadline:
+            self.tripped = True
+            raise DeadlineExceeded(f"Projected to finish {finish - self.deadline:.0f}s past the deadline")
+
+
+def estimate_filesize(fmt, duration):
+    """Size of a format in bytes, falling back to bitrate x duration"""
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and fmt.get('tbr') and duration:
+        size = fmt['tbr'] * 1000 / 8 * duration
+    return size
+
+def rank_formats(info, media_format='mp4'):
+    """
+    List the downloadable format choices for a video, best quality first
+
+    Returns:
+        list: dicts with the yt-dlp 'format' string, estimated 'size' in bytes,
+        'quality' and the seconds expected for 'postprocess'
+    """
+    duration = info.get('duration') or 0
+    formats = [f for f in info.get('formats') or [] if estimate_filesize(f, duration)]
+    audio = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+
+    candidates = []
+    if media_format == 'mp3':
+        for fmt in audio:
+            candidates.append({
+                'format': fmt['format_id'],
+                'size': estimate_filesize(fmt, duration),
+                'quality': fmt.get('abr') or fmt.get('tbr') or 0
+            })
+    else:
+        m4a_audio = [f for f in audio if f.get('ext') == 'm4a']
+        best_audio = max(m4a_audio, key=lambda f: f.get('abr') or f.get('tbr') or 0) if m4a_audio else None
+        for fmt in formats:
+            if fmt.get('ext') != 'mp4' or not fmt.get('height') or fmt.get('vcodec') == 'none':
+                continue
+            size = estimate_filesize(fmt, duration)
+            if fmt.get('acodec') not in (None, 'none'):
+                candidates.append({'format': fmt['format_id'], 'size': size, 'quality': fmt['height']})
+            elif best_audio:
+                candidates.append({
+                    'format': f"{fmt['format_id']}+{best_audio['format_id']}",
+                    'size': size + estimate_filesize(best_audio, duration),
+                    'quality': fmt['height']
+                })
+
+    for candidate in candidates:
+        # Merging streams or converting to mp3 runs FFmpeg after the download
+        needs_ffmpeg = media_format == 'mp3' or '+' in candidate['format']
+        candidate['postprocess'] = candidate['size'] / POSTPROCESS_THROUGHPUT if needs_ffmpeg else 0
+
+    # Best quality first; among equal quality prefer the smaller download
+    candidates.sort(key=lambda c: (-c['quality'], c['size']))
+    return candidates
+
+def select_format(candidates, time_budget, throughput):
+    """Pick the best candidate expected to download within `time_budget` seconds"""
+    for candidate in candidates:
+        if candidate['size'] / throughput + candidate['postprocess'] <= time_budget:
+            return candidate
+    # Nothing fits: take the smallest download and get as close as we can
+    return min(candidates, key=lambda c: c['size'])
+
+def downloaded_filepath(result):
+    """Final path of the file yt-dlp produced, after merging and post-processing"""
+    requested_downloads = result.get('requested_downloads') or [result]
+    return requested_downloads[0].get('filepath')
+
+def _remove_partial_files(ydl, info, candidate):
+    """Delete everything an aborted attempt left behind, including finished streams of a merge"""
+    stem = glob.escape(os.path.splitext(ydl.prepare_filename(info))[0])
+    patterns = [stem + '.*part', stem + '.*part-Frag*', stem + '.*ytdl']
+    patterns += [f"{stem}.f{glob.escape(format_id)}.*" for format_id in candidate['format'].split('+')]
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def download_within_budget(url, ydl_opts, media_format, deadline, info=None, link='direct', handoff_throughput=None):
+    """
+    Download the best quality expected to finish by `deadline`
+
+    `deadline` is an absolute time.time() timestamp, so time the caller spent
+    before the download (queueing, extraction) counts against the budget. With
+    `handoff_throughput` in bytes per second, the time to pass the file on after
+    the download (e.g. uploading it) is reserved as well.
+
+    Format choice is based on the measured throughput of recent downloads over
+    `link`. If throughput drops mid-download so the deadline would be missed,
+    the attempt is aborted and restarted at the best lower quality that still
+    fits the remaining time. The lowest quality is never aborted.
+
+    Returns:
+        tuple: the candidate that was downloaded (None if no format had a size
+        estimate and ydl_opts['format'] was downloaded as is) and the final file path
+    """
+    tracker = ThroughputTracker(link)
+
+    if info is None:
+        with create_ydl(ydl_opts) as ydl:
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+    candidates = rank_formats(info, media_format)
+    if handoff_throughput:
+        for candidate in candidates:
+            candidate['postprocess'] += candidate['size'] / handoff_throughput
+    if not candidates:
+        logger.warning("No size estimates available, downloading the default format")
+        with create_ydl(ydl_opts) as ydl:
+            result = ydl.process_ie_result(ydl.sanitize_info(info, remove_private_keys=True), download=True)
+        return None, downloaded_filepath(result)
+
+    throughput = tracker.estimate()
+    while True:
+        remaining = deadline - time.time()
+        candidate = select_format(candidates, remaining, throughput)
+        is_last = candidate is min(candidates, key=lambda c: c['size'])
+        logger.info(f"Selected format {candidate['format']} ({candidate['size'] / (1024*1024):.1f} MB) "
+                    f"for {remaining:.0f}s budget at {throughput / (1024*1024):.2f} MB/s")
+
+        meter = ThroughputMeter()
+        hooks = list(ydl_opts.get('progress_hooks', [])) + [meter]
+        guard = None
+        if not is_last:
+            guard = DeadlineGuard(deadline, candidate, meter)
+            hooks.append(guard)
+        attempt_opts = {
+            **ydl_opts,
+            'format': candidate['format'],
+            'progress_hooks': hooks,
+            # A lower quality attempt must not resume the aborted one's partial file
+            'continuedl': False
+        }
+
+        with create_ydl(attempt_opts) as ydl:
+            try:
+                result = ydl.process_ie_result(ydl.sanitize_info(info, remove_private_keys=True), download=True)
+            except Exception:
+                if not (guard and guard.tripped):
+                    raise
+                tracker.record(meter.downloaded_bytes, meter.elapsed)
+                _remove_partial_files(ydl, info, candidate)
+                throughput = (meter.throughput or throughput) * SAFETY_FACTOR
+                # Only ever step down from here
+                candidates = [c for c in candidates if c['quality'] < candidate['quality']] or [min(candidates, key=lambda c: c['size'])]
+                logger.warning(f"Throughput dropped to {throughput / (1024*1024):.2f} MB/s, downgrading")
+                continue
+
+        tracker.record(meter.downloaded_bytes, meter.elapsed)
+        return candidate, downloaded_filepath(result)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import yt_dlp
+from cookie_provider import create_ydl
 
 # URL of the video you want to download (change this to any YouTube URL)
 VIDEO_URL = "https://www.youtube.com/watch?v=D4llDi20gM4"
@@ -29,7 +30,7 @@ def download_video(url):
     
     try:
         # Create a YoutubeDL object with our options
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with create_ydl(ydl_opts) as ydl:
             # Get video information first
             info = ydl.extract_info(url, download=False)
             
@@ -50,7 +51,7 @@ def download_video(url):
             print("Trying with a different format...")
             ydl_opts['format'] = 'best'
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                with create_ydl(ydl_opts) as ydl:
                     ydl.download([url])
                     print("Download complete!")
             except Exception as e2:
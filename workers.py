@@ -0,0 +1,150 @@
+import os
+import logging
+import threading
+import multiprocessing
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cookie_provider import create_ydl, check_auth_error
+from quality_selector import ThroughputMeter, ThroughputTracker, download_within_budget, downloaded_filepath
+
+logger = logging.getLogger(__name__)
+
+# Extraction is CPU bound Python, so use one process per core; recycle workers to cap memory growth
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', os.cpu_count() or 1))
+WORKER_MAX_JOBS = int(os.getenv('WORKER_MAX_JOBS', 20))
+# Downloads mostly wait on the network, so they get their own, larger pool and can't starve extraction
+DOWNLOAD_PROCESSES = int(os.getenv('DOWNLOAD_PROCESSES', 2 * (os.cpu_count() or 1)))
+
+_POOL_SIZES = {'extract': WORKER_PROCESSES, 'download': DOWNLOAD_PROCESSES}
+_pools = {}
+_manager = None
+_log_listener = None
+_lock = threading.Lock()
+
+class _ParentLogHandler(logging.Handler):
+    """Hand records from the workers to the parent's loggers, and so to its handlers"""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def _init_worker(log_queue, level):
+    """Send the worker's log records to the parent process, which owns the log file"""
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(log_queue)]
+    root.setLevel(level)
+
+def _get_log_queue():
+    # Called with _lock held
+    global _log_listener
+    if _log_listener is None:
+        _log_listener = QueueListener(multiprocessing.get_context('spawn').Queue(), _ParentLogHandler())
+        _log_listener.start()
+    return _log_listener.queue
+
+def _get_pool(kind):
+    with _lock:
+        if kind not in _pools:
+            logger.info(f"Starting {_POOL_SIZES[kind]} {kind} workers, recycled every {WORKER_MAX_JOBS} jobs")
+            _pools[kind] = ProcessPoolExecutor(
+                max_workers=_POOL_SIZES[kind],
+                # Fork would copy the Streamlit server's threads and locks into the workers. Spawned
+                # children re-import the main script as __mp_main__, so app.py keeps its side effects
+                # under the __main__ guard
+                mp_context=multiprocessing.get_context('spawn'),
+                max_tasks_per_child=WORKER_MAX_JOBS,
+                initializer=_init_worker,
+                initargs=(_get_log_queue(), logging.getLogger().getEffectiveLevel())
+            )
+        return _pools[kind]
+
+def get_manager():
+    """Manager whose queues can be handed to worker jobs for progress reporting"""
+    global _manager
+    with _lock:
+        if _manager is None:
+            _manager = multiprocessing.get_context('spawn').Manager()
+        return _manager
+
+def _submit(kind, fn, *args):
+    pool = _get_pool(kind)
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        logger.warning(f"{kind.capitalize()} pool broken, restarting it")
+        with _lock:
+            if _pools.get(kind) is pool:
+                del _pools[kind]
+        return _get_pool(kind).submit(fn, *args)
+
+def submit(fn, *args):
+    """Run a job in the extraction pool, restarting the pool once if a worker died"""
+    return _submit('extract', fn, *args)
+
+def submit_download(fn, *args):
+    """Run a job in the download pool, restarting the pool once if a worker died"""
+    return _submit('download', fn, *args)
+
+class DownloadCancelled(Exception):
+    """Raised from a hook when the session that started a download has gone away"""
+
+
+def extract_info_job(url, ydl_opts):
+    """Extract video information in a worker process"""
+    try:
+        with create_ydl(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            # Results cross the process boundary, so strip anything that can't be pickled
+            return ydl.sanitize_info(info)
+    except Exception as e:
+        # Cookie sets are per process, so rejected cookies must be flagged here
+        check_auth_error(e)
+        raise
+
+def download_job(info, ydl_opts, progress_queue=None, media_format=None, deadline=None, cancel_event=None):
+    """
+    Download an already extracted video in a worker process, reporting progress to `progress_queue`
+    and returning the path of the final file
+
+    With a `deadline` (a time.time() timestamp) the format is chosen by download_within_budget instead of
+    ydl_opts['format'].
+    Setting `cancel_event` stops the download at the next progress or post-processing update.
+    """
+    def report_progress(d):
+        progress_queue.put({
+            'status': d.get('status'),
+            'downloaded': d.get('downloaded_bytes') or 0,
+            'total': d.get('total_bytes') or d.get('total_bytes_estimate') or 0,
+            'speed': d.get('speed')
+        })
+
+    def check_cancelled(d):
+        if cancel_event.is_set():
+            raise DownloadCancelled("Download cancelled")
+
+    progress_hooks = []
+    if progress_queue is not None:
+        progress_hooks.append(report_progress)
+    if cancel_event is not None:
+        progress_hooks.append(check_cancelled)
+        ydl_opts = {**ydl_opts, 'postprocessor_hooks': [check_cancelled]}
+    if progress_hooks:
+        ydl_opts = {**ydl_opts, 'progress_hooks': progress_hooks}
+
+    try:
+        if deadline:
+            _, filepath = download_within_budget(None, ydl_opts, media_format, deadline, info=info)
+            return filepath
+
+        # Measure fixed-quality downloads too, so the budgeted ones have history to plan with
+        meter = ThroughputMeter()
+        ydl_opts = {**ydl_opts, 'progress_hooks': ydl_opts.get('progress_hooks', []) + [meter]}
+        with create_ydl(ydl_opts) as ydl:
+            result = ydl.process_ie_result(ydl.sanitize_info(info, remove_private_keys=True), download=True)
+        ThroughputTracker().record(meter.downloaded_bytes, meter.elapsed)
+        return downloaded_filepath(result)
+    except Exception as e:
+        check_auth_error(e)
+        raise
@@ -1,9 +1,9 @@
-import yt_dlp
 import logging
 import os
 import tempfile
 from datetime import datetime
 import http.client
+from cookie_provider import create_ydl, check_auth_error
 
 
 # 
@@ -82,7 +82,7 @@ def download_video(url, format='mp4', quality='normal', output_dir='downloads',
         }]
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with create_ydl(ydl_opts) as ydl:
             # Log the full options being used
             logger.debug(f"YouTube-DL Options: {ydl_opts}")
             
@@ -135,6 +135,7 @@ def download_video(url, format='mp4', quality='normal', output_dir='downloads',
             
     except Exception as e:
         logger.error(f"Error downloading video: {str(e)}")
+        check_auth_error(e)
         return None
 
 if __name__ == "__main__":
@@ -1,11 +1,13 @@
-import yt_dlp
 import logging
 import os
 import tempfile
 from datetime import datetime
 import http.client
+import time
 import os
 from dotenv import load_dotenv
+from cookie_provider import get_cookie_set, create_ydl, check_auth_error
+from quality_selector import ThroughputMeter, ThroughputTracker, download_within_budget
 
 # Load environment variables
 load_dotenv()
@@ -35,10 +37,18 @@ def get_proxy_url():
     
     return f'http://{username}:{password}@{host}:{port}'
 
-def download_video(url, format='mp4', quality='normal', output_dir='downloads'):
+# Seconds allowed for 'auto' quality when no --time-budget is given
+DEFAULT_TIME_BUDGET = int(os.getenv('DOWNLOAD_TIME_BUDGET', 300))
+
+def download_video(url, format='mp4', quality='normal', output_dir='downloads', time_budget=None):
     """
     Download a video from YouTube using IPRoyal proxy with detailed request logging
+
+    With quality 'auto' the best format expected to finish within `time_budget`
+    seconds is chosen from the measured proxy throughput. The budget starts now,
+    so proxy setup and extraction count against it.
     """
+    deadline = time.time() + (time_budget or DEFAULT_TIME_BUDGET)
     # Ensure output directory exists
     os.makedirs(output_dir, exist_ok=True)
     
@@ -73,8 +83,6 @@ def download_video(url, format='mp4', quality='normal', output_dir='downloads'):
         },
         'socket_timeout': 30,
         'retries': 3,
-        # Add cookies support
-        'cookiesfrombrowser': ('chrome',),
         # Add more options to bypass restrictions
         'extractor_retries': 3,
         'fragment_retries': 3,
@@ -85,13 +93,19 @@ def download_video(url, format='mp4', quality='normal', output_dir='downloads'):
         'sleep_interval_requests': 1,
     }
     
+    # Use the shared cookie jar; only fall back to reading Chrome's cookie database without one
+    cookie_set = get_cookie_set()
+    if not cookie_set.is_valid():
+        logger.info("No valid shared cookies, falling back to browser cookies")
+        common_opts['cookiesfrombrowser'] = ('chrome',)
+
     # Set format string based on quality and format
     if format == 'mp4':
         if quality == 'high':
             format_string = 'bestvideo[ext=mp4][height>=1080]+bestaudio[ext=m4a]/best[ext=mp4]/best'
         elif quality == 'medium':
             format_string = 'bestvideo[ext=mp4][height>=720][height<1080]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-        else:  # normal
+        else:  # normal, or the fallback for auto
             format_string = 'best[ext=mp4]'
     else:  # mp3
         format_string = 'bestaudio/best'
@@ -112,7 +126,7 @@ def download_video(url, format='mp4', quality='normal', output_dir='downloads'):
         }]
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with create_ydl(ydl_opts, cookie_set.path) as ydl:
             # Log the full options being used (hiding proxy password)
             safe_opts = dict(ydl_opts)
             if 'proxy' in safe_opts:
@@ -130,11 +144,24 @@ def download_video(url, format='mp4', quality='normal', output_dir='downloads'):
             logger.info(f"- Duration: {info.get('duration')} seconds")
             logger.info(f"- View Count: {info.get('view_count')}")
             logger.info(f"- Available Formats: {len(info.get('formats', []))}")
-            logger.info(f"- Selected Format: {format_string}")
+            if quality == 'auto':
+                logger.info(f"- Selected Format: auto, within {deadline - time.time():.0f}s")
+            else:
+                logger.info(f"- Selected Format: {format_string}")
             
             # Perform the download
             logger.info("Starting download through proxy...")
-            ydl.download([url])
+            downloaded_path = None
+            if quality == 'auto':
+                candidate, downloaded_path = download_within_budget(
+                    url, ydl_opts, format, deadline,
+                    info=ydl.sanitize_info(info), link='proxy')
+                logger.info(f"- Downloaded Format: {candidate['format'] if candidate else format_string}")
+            else:
+                meter = ThroughputMeter()
+                ydl.add_progress_hook(meter)
+                ydl.download([url])
+                ThroughputTracker('proxy').record(meter.downloaded_bytes, meter.elapsed)
             
             # Get the output filename
             if format == 'mp3':
@@ -142,12 +169,13 @@ def download_video(url, format='mp4', quality='normal', output_dir='downloads'):
             else:
                 filename = f"{info.get('title')}.mp4"
             
-            output_path = os.path.join(output_dir, filename)
+            output_path = downloaded_path or os.path.join(output_dir, filename)
             logger.info(f"Download completed: {output_path}")
             return output_path
             
     except Exception as e:
         logger.error(f"Error downloading video: {str(e)}")
+        check_auth_error(e, cookie_set.path)
         return None
 
 if __name__ == "__main__":
@@ -156,11 +184,17 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Download YouTube videos through IPRoyal proxy')
     parser.add_argument('url', help='YouTube URL')
     parser.add_argument('--format', choices=['mp4', 'mp3'], default='mp4', help='Output format (mp4 or mp3)')
-    parser.add_argument('--quality', choices=['normal', 'medium', 'high'], default='normal', help='Video quality')
+    parser.add_argument('--quality', choices=['normal', 'medium', 'high', 'auto'], default='normal', help='Video quality (auto picks the best that fits --time-budget)')
     parser.add_argument('--output', default='downloads', help='Output directory')
+    parser.add_argument('--time-budget', type=int, help='Seconds the download may take when --quality is auto')
     
     args = parser.parse_args()
+    if args.time_budget is not None:
+        if args.quality != 'auto':
+            parser.error('--time-budget requires --quality auto')
+        if args.time_budget <= 0:
+            parser.error('--time-budget must be a positive number of seconds')
     
-    output_path = download_video(args.url, args.format, args.quality, args.output)
+    output_path = download_video(args.url, args.format, args.quality, args.output, args.time_budget)
     if output_path:
         print(f"Successfully downloaded to: {output_path}") 
\ No newline at end of file